@@ -13,22 +13,26 @@
 #     limitations under the License.
 import warnings
 from datetime import datetime
+from importlib.util import find_spec
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Optional, Dict, Callable, Tuple
 
 import numpy as np
 import pandas as pd
+from joblib import Parallel, cpu_count, delayed
 from matplotlib import pyplot as plt
-from numpy.polynomial.polynomial import polyfit
 
 from qf_lib.analysis.backtests_overfitting.minimum_backtest_length import minBTL
 
+# scipy is imported only when the fitted lines are computed, as it is not needed to set up the analysis
+is_scipy_installed = find_spec("scipy") is not None
+
 try:
-    from scipy.optimize import curve_fit
-    from scipy.stats import stats
-    is_scipy_installed = True
+    import python_calamine  # noqa: F401
+    # The calamine engine of pandas.read_excel is available since pandas 2.2
+    is_calamine_available = tuple(int(v) for v in pd.__version__.split(".")[:2]) >= (2, 2)
 except ImportError:
-    is_scipy_installed = False
+    is_calamine_available = False
 
 
 from qf_lib.analysis.common.abstract_document import AbstractDocument
@@ -65,6 +69,50 @@ from qf_lib.settings import Settings
 from qf_lib.analysis.backtests_overfitting.overfitting_analysis import OverfittingAnalysis
 
 
+def _daily_sharpe_ratio(series: QFSeries) -> float:
+    return sharpe_ratio(series, Frequency.DAILY)
+
+
+def _daily_sortino_ratio(series: QFSeries) -> float:
+    return sorino_ratio(series, Frequency.DAILY)
+
+
+def _total_return(series: QFSeries) -> float:
+    return series.to_prices().total_cumulative_return()
+
+
+def _compute_overfitting_analysis(strategies_returns: SimpleReturnsDataFrame, ranking_function: Callable,
+                                  num_of_slices: int) -> OverfittingAnalysis:
+    """ Creates the OverfittingAnalysis and computes its IS / OOS rankings, so that it can be run in a subprocess. """
+    overfitting_analysis = OverfittingAnalysis(strategies_returns, ranking_function=ranking_function,
+                                               num_of_slices=num_of_slices)
+    overfitting_analysis.drop_is_oos_sets()
+
+    # the input returns are already available in the parent process, there is no need to send them back
+    overfitting_analysis.multiple_returns_timeseries = None
+    return overfitting_analysis
+
+
+def _linear_fit(x: np.ndarray, y: np.ndarray) -> Tuple[float, float]:
+    """ Returns the slope and the intercept of the least squares fit of the line y = slope * x + intercept. """
+    x_mean, y_mean = x.mean(), y.mean()
+    x_deviations = x - x_mean
+    slope = (x_deviations * (y - y_mean)).sum() / (x_deviations ** 2).sum()
+    intercept = y_mean - slope * x_mean
+    return slope, intercept
+
+
+def _empirical_cdf(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """ Returns the sorted unique values and the empirical CDF probabilities corresponding to them. """
+    unique_values, counts = np.unique(values, return_counts=True)
+    return unique_values, np.cumsum(counts) / values.size
+
+
+def _is_oos_fit_function(x: np.ndarray, a: float, b: float, c: float) -> np.ndarray:
+    """ Exponential curve fitted to the OOS vs IS qualities of a strategy. """
+    return a * np.exp(-b * x) + c
+
+
 @ErrorHandling.class_error_logging()
 class BacktestOverfittingSheet(AbstractDocument):
     """
@@ -93,10 +141,10 @@ class BacktestOverfittingSheet(AbstractDocument):
             exit(1)
 
         self.ranking_functions = {
-            "Sharpe Ratio": lambda series: sharpe_ratio(series, Frequency.DAILY),
-            "Sortino Ratio": lambda series: sorino_ratio(series, Frequency.DAILY),
+            "Sharpe Ratio": _daily_sharpe_ratio,
+            "Sortino Ratio": _daily_sortino_ratio,
             "Omega Ratio": omega_ratio,
-            "Total return": lambda series: series.to_prices().total_cumulative_return()
+            "Total return": _total_return
         }
 
         self.overfitting_analysis = {}  # type: Dict[str, OverfittingAnalysis]
@@ -108,7 +156,7 @@ class BacktestOverfittingSheet(AbstractDocument):
 
     def setup_overfitting_analysis(self, top_dir_path: Optional[str] = None,
                                    strategies_returns: Optional[SimpleReturnsDataFrame] = None,
-                                   num_of_slices: int = 8):
+                                   num_of_slices: int = 8, n_jobs: Optional[int] = None):
         """
         Performs the overfitting analysis given either the path to the top directory, which contains the Timeseries
         excel files (in its subdirectories) generated by the backtest monitor, or the data frame containing the
@@ -124,8 +172,11 @@ class BacktestOverfittingSheet(AbstractDocument):
             should contain the simple returns of each of variants of the strategy / each of strategies.
         num_of_slices: int
             number of slices used in the overfitting analysis
+        n_jobs: Optional[int]
+            number of processes used to compute the analyses for all ranking functions (by default one process per
+            ranking function is used, but not more than the number of CPUs)
         """
-        if (top_dir_path is None) == (strategies_returns is None):
+        if (top_dir_path is None) is (strategies_returns is None):
             raise ValueError("In order to complete the analysis you need to either provide the path to the top "
                              "directory with Timeseries files or the data frame of returns. Please provide exactly "
                              "one of these parameters.")
@@ -133,10 +184,13 @@ class BacktestOverfittingSheet(AbstractDocument):
         if strategies_returns is None:
             strategies_returns = self.get_timeseries_returns(top_dir=top_dir_path)
 
-        for function_name, ranking_function in self.ranking_functions.items():
-            self.overfitting_analysis[function_name] = OverfittingAnalysis(strategies_returns,
-                                                                           ranking_function=ranking_function,
-                                                                           num_of_slices=num_of_slices)
+        n_jobs = n_jobs or min(len(self.ranking_functions), cpu_count())
+        overfitting_analyses = Parallel(n_jobs=n_jobs, backend="loky")(
+            delayed(_compute_overfitting_analysis)(strategies_returns, ranking_function, num_of_slices)
+            for ranking_function in self.ranking_functions.values())
+        for overfitting_analysis in overfitting_analyses:
+            overfitting_analysis.multiple_returns_timeseries = strategies_returns
+        self.overfitting_analysis = dict(zip(self.ranking_functions.keys(), overfitting_analyses))
 
         self.number_of_strategies = strategies_returns.num_of_columns
         backtest_start_date = strategies_returns.index[0]
@@ -155,7 +209,7 @@ class BacktestOverfittingSheet(AbstractDocument):
         self._add_logits_distribution_chart()
         self._add_stochastic_dominance_chart()
 
-    def get_timeseries_returns(self, top_dir: str) -> SimpleReturnsDataFrame:
+    def get_timeseries_returns(self, top_dir: str, n_jobs: int = -1) -> SimpleReturnsDataFrame:
         """
         Given the path to a directory it searches for all Timeseries excel files, which are related to various
         strategies. Each standard Timeseries file contains an index in the first column and timeseries of the portfolio
@@ -169,20 +223,22 @@ class BacktestOverfittingSheet(AbstractDocument):
         ----------
         top_dir: str
             path to the top directory
+        n_jobs: int
+            number of threads used to read the excel files (by default all available cores are used)
 
         Returns
         -------
         SimpleReturnsDataFrame
             dataframe containing simple returns of all strategies
         """
-        data_frames = []
+        # Use the Rust based calamine reader if it is installed, otherwise fall back to the default one (openpyxl)
+        engine = "calamine" if is_calamine_available else None
 
-        p = Path(top_dir)
-        for excel_tms in p.glob(r"**/*Timeseries.xlsx"):
-            df = PricesDataFrame(pd.read_excel(excel_tms, index_col=0))
-            data_frames.append(df)
+        excel_paths = list(Path(top_dir).glob(r"**/*Timeseries.xlsx"))
+        data_frames = Parallel(n_jobs=n_jobs, prefer="threads")(
+            delayed(pd.read_excel)(excel_tms, index_col=0, engine=engine) for excel_tms in excel_paths)
 
-        df = pd.concat(data_frames, axis=1).to_simple_returns()
+        df = PricesDataFrame(pd.concat(data_frames, axis=1, copy=False)).to_simple_returns()
         return df
 
     def _add_minimum_backtest_length_plot(self, estimated_maximum: float = 1.0):
@@ -211,18 +267,15 @@ class BacktestOverfittingSheet(AbstractDocument):
         chart.add_decorator(axes_decorator)
 
         max_number_of_backtests = 100
-        number_of_trials = QFSeries(data=range(1, max_number_of_backtests))
+        trials = np.arange(1, max_number_of_backtests)
+        number_of_trials = QFSeries(data=trials)
 
         # Color scheme used for the chart
         red_color = "#A40000"
         green_color = "#00a452"
 
         # Compute both data series that need to be plotted
-        def upper_bound_minBTL(samples_number: int):
-            return 2 * np.log(samples_number) / (estimated_maximum ** 2)
-
-        upper_bound_series = QFSeries(data=[upper_bound_minBTL(no) for no in number_of_trials],
-                                      index=range(1, max_number_of_backtests))
+        upper_bound_series = QFSeries(data=2 * np.log(trials) / (estimated_maximum ** 2), index=trials)
         minimum_backtest_length_series = minBTL(number_of_trials, estimated_maximum)
 
         # Add both data series to the plot
@@ -235,7 +288,8 @@ class BacktestOverfittingSheet(AbstractDocument):
         legend.add_entry(upper_bound, "Upper bound for MinBTL")
 
         # Check if in our case the condition is satisfied
-        condition_satisfied = self.backtests_length > minBTL(self.number_of_strategies)
+        min_backtest_length = minBTL(self.number_of_strategies)
+        condition_satisfied = self.backtests_length > min_backtest_length
 
         # Add the point with current values, emphasize it with appropriate colour
         chart.add_decorator(legend)
@@ -257,8 +311,7 @@ class BacktestOverfittingSheet(AbstractDocument):
         green_fill = FillBetweenDecorator(lower_bound=minimum_backtest_length_series,
                                           colors_alpha=0.1, color=green_color,
                                           upper_bound=QFSeries(
-                                              data=[y_upper_bound for _ in range(1, max_number_of_backtests)],
-                                              index=range(1, max_number_of_backtests)))
+                                              data=np.full(trials.size, y_upper_bound), index=trials))
         chart.add_decorator(green_fill)
 
         self.document.add_element(ChartElement(chart, figsize=self.full_image_size, dpi=self.dpi))
@@ -270,7 +323,7 @@ class BacktestOverfittingSheet(AbstractDocument):
                                                    "The MinBTL for {} backtests equals {:.2f} years and the number of "
                                                    "years we used for the backtests was equal to {:.2f}.".format(
                                                         "satisfied" if condition_satisfied else "not satisfied",
-                                                        self.number_of_strategies, minBTL(self.number_of_strategies),
+                                                        self.number_of_strategies, min_backtest_length,
                                                         self.backtests_length)))
         self.document.add_element(ParagraphElement("\n"))
 
@@ -339,33 +392,40 @@ class BacktestOverfittingSheet(AbstractDocument):
             grid = self._get_new_grid()
 
             df = oa.get_best_strategies_is_oos_qualities()
+            is_values = df["IS"].to_numpy()
+            oos_values = df["OOS"].to_numpy()
+            is_min, is_max = is_values.min(), is_values.max()
+            oos_min, oos_max = oos_values.min(), oos_values.max()
 
             chart = LineChart()
-            chart.add_decorator(ScatterDecorator(x_data=df["IS"], y_data=df["OOS"], size=10))
+            chart.add_decorator(ScatterDecorator(x_data=is_values, y_data=oos_values, size=10))
             chart.add_decorator(TitleDecorator("IS vs OOS comparison - {}".format(function_name), key="title"))
             chart.add_decorator(
                 AxesLabelDecorator(x_label="In-Sample performance", y_label="Out-Of-Sample performance"))
             grid.add_chart(chart)
 
-            slope, intercept = polyfit(df["IS"], df["OOS"])
-            x_range = np.linspace(df["IS"].min(), df["IS"].max(), num=200)
+            slope, intercept = _linear_fit(is_values, oos_values)
+            # The fitted line is straight, so its end points are sufficient to plot it
+            x_range = np.array([is_min, is_max])
             y_range = slope * x_range + intercept
             chart.add_decorator(DataElementDecorator(QFSeries(index=x_range, data=y_range),
                                                      color="black", linestyle="dashed", linewidth=1))
 
-            text_position_shift = (df["OOS"].max() - df["OOS"].min()) / 20
+            text_position_shift = (oos_max - oos_min) / 20
+            mid_x = x_range.mean()
+            mid_y = slope * mid_x + intercept
             chart.add_decorator(TextDecorator("y = {:.2f}x + {:.2f}".format(slope, intercept),
-                                              x=DataCoordinate(x_range[len(x_range) // 2]),
-                                              y=DataCoordinate(y_range[len(x_range) // 2] + text_position_shift),
+                                              x=DataCoordinate(mid_x),
+                                              y=DataCoordinate(mid_y + text_position_shift),
                                               size=8))
 
             grid.add_chart(self._get_is_oos_fit_chart(oa, top_strategies_to_plot=4))
 
-            is_hist = HistogramChart(df["IS"], best_fit=True, bins=20)
+            is_hist = HistogramChart(is_values, best_fit=True, bins=20)
             is_hist.add_decorator(TitleDecorator(title="In-Sample {} histogram".format(function_name), key="title"))
             grid.add_chart(is_hist)
 
-            oos_hist = HistogramChart(df["OOS"], best_fit=True, bins=20)
+            oos_hist = HistogramChart(oos_values, best_fit=True, bins=20)
             oos_hist.add_decorator(
                 TitleDecorator(title="Out-Of-Sample {} histogram".format(function_name), key="title"))
             grid.add_chart(oos_hist)
@@ -399,7 +459,7 @@ class BacktestOverfittingSheet(AbstractDocument):
 
         for function_name, oa in self.overfitting_analysis.items():
             logits = oa.calculate_relative_rank_logits(oa.best_is_strategies_names)
-            logits_histogram = HistogramChart(logits.values, best_fit=True)
+            logits_histogram = HistogramChart(np.ascontiguousarray(logits.values, dtype=np.float64), best_fit=True)
             logits_histogram.add_decorator(TitleDecorator(title="Logits distribution - {}".format(function_name),
                                                           key="title"))
             logits_histogram.add_decorator(AxesLabelDecorator(x_label="Logit value", y_label="Frequency"))
@@ -442,27 +502,27 @@ class BacktestOverfittingSheet(AbstractDocument):
         for function_name, oa in self.overfitting_analysis.items():
             oos_qualities = oa.get_best_strategies_is_oos_qualities()["OOS"]
 
-            x_values = np.sort(oos_qualities.values)
-            best_qualities = QFSeries(data=stats.ecdf(x_values).cdf.probabilities, index=x_values)
-
-            all_oos_qualities = [oos_ranking["quality"].median() for oos_ranking in oa.oos_ranking]
+            best_x_values, best_probabilities = _empirical_cdf(oos_qualities.values)
 
-            x_values = np.sort(all_oos_qualities)
-            qualities = QFSeries(data=stats.ecdf(x_values).cdf.probabilities, index=x_values)
+            all_oos_qualities = np.median(
+                np.column_stack([oos_ranking["quality"].values for oos_ranking in oa.oos_ranking]), axis=0)
+            x_values, probabilities = _empirical_cdf(all_oos_qualities)
 
             # Adjust the end of the lines
-            if best_qualities.idxmax() < qualities.idxmax() and max(best_qualities) == 1:
-                best_qualities.loc[qualities.idxmax()] = 1.0
-            elif best_qualities.idxmax() > qualities.idxmax() and max(qualities) == 1:
-                qualities.loc[best_qualities.idxmax()] = 1.0
+            if best_x_values[-1] < x_values[-1] and best_probabilities[-1] == 1:
+                best_x_values = np.append(best_x_values, x_values[-1])
+                best_probabilities = np.append(best_probabilities, 1.0)
+            elif best_x_values[-1] > x_values[-1] and probabilities[-1] == 1:
+                x_values = np.append(x_values, best_x_values[-1])
+                probabilities = np.append(probabilities, 1.0)
 
             chart = LineChart()
             legend = LegendDecorator()
-            data = DataElementDecorator(best_qualities)
+            data = DataElementDecorator(QFSeries(data=best_probabilities, index=best_x_values))
             chart.add_decorator(data)
             legend.add_entry(data, "Optimised")
 
-            data = DataElementDecorator(qualities)
+            data = DataElementDecorator(QFSeries(data=probabilities, index=x_values))
             chart.add_decorator(data)
             legend.add_entry(data, "Non-optimised")
 
@@ -473,29 +533,33 @@ class BacktestOverfittingSheet(AbstractDocument):
         self.document.add_element(grid)
 
     def _get_is_oos_fit_chart(self, oa: OverfittingAnalysis, top_strategies_to_plot: int = 4) -> Chart:
+        from scipy.optimize import curve_fit
+
+        # Qualities of all strategies (rows) in all IS / OOS sets (columns)
+        is_qualities = pd.concat([is_ranking["quality"] for is_ranking in oa.is_ranking], axis=1)
+        oos_qualities = pd.concat([oos_ranking["quality"] for oos_ranking in oa.oos_ranking], axis=1)
+
         # Find top best OOS / IS performing strategies
-        mean_quality_for_each_strategy_in_oos = pd.concat(
-            [oos_qualities["quality"] for oos_qualities in oa.oos_ranking], axis=1).mean(axis=1)
+        mean_quality_for_each_strategy_in_oos = QFSeries(data=oos_qualities.values.mean(axis=1),
+                                                         index=oos_qualities.index)
         top_strategies_names = mean_quality_for_each_strategy_in_oos.nlargest(top_strategies_to_plot).index
 
         chart = LineChart()
         legend = LegendDecorator()
 
-        def func(x, a, b, c):
-            return a * np.exp(-b * x) + c
+        x_range = np.linspace(is_qualities.values.min(), is_qualities.values.max(), 1000)
 
-        min_is_performance = min([i["quality"].min() for i in oa.is_ranking])
-        max_is_performance = max([i["quality"].max() for i in oa.is_ranking])
-        x_range = np.linspace(min_is_performance, max_is_performance, 1000)
+        # IS / OOS qualities of the top strategies (rows), sorted by the IS quality of each strategy
+        top_is_values = is_qualities.loc[top_strategies_names].values
+        top_oos_values = oos_qualities.loc[top_strategies_names].values
+        order = np.argsort(top_is_values, axis=1, kind="stable")
+        top_is_values = np.take_along_axis(top_is_values, order, axis=1)
+        top_oos_values = np.take_along_axis(top_oos_values, order, axis=1)
 
-        for ind, strategy in enumerate(top_strategies_names):
+        for ind, (is_values, oos_values) in enumerate(zip(top_is_values, top_oos_values)):
             try:
-                is_vs_oos = sorted([(is_qualities.loc[strategy, "quality"], oos_qualities.loc[strategy, "quality"])
-                                    for is_qualities, oos_qualities in zip(oa.is_ranking, oa.oos_ranking)],
-                                   key=lambda i: i[0])
-
-                popt, _ = curve_fit(func, [i[0] for i in is_vs_oos], [i[1] for i in is_vs_oos], maxfev=5000)
-                data_points = QFSeries(index=x_range, data=[func(x, *popt) for x in x_range])
+                popt, _ = curve_fit(_is_oos_fit_function, is_values, oos_values, maxfev=5000)
+                data_points = QFSeries(index=x_range, data=_is_oos_fit_function(x_range, *popt))
                 data_element = DataElementDecorator(data_points)
                 chart.add_decorator(data_element)
                 legend.add_entry(data_element, "TOP {}".format(ind + 1))
@@ -509,9 +573,9 @@ class BacktestOverfittingSheet(AbstractDocument):
         return chart
 
     def save(self, report_dir: str = ""):
-        # Set the style for the report
-        plt.style.use(['tearsheet'])
-
         filename = "%Y_%m_%d-%H%M {}.pdf".format(self.title)
         filename = datetime.now().strftime(filename)
-        return self.pdf_exporter.generate([self.document], report_dir, filename)
+
+        # Set the style for the report only, so that it does not leak into the global matplotlib settings
+        with plt.style.context(['tearsheet']):
+            return self.pdf_exporter.generate([self.document], report_dir, filename)
@@ -60,6 +60,8 @@ class OverfittingAnalysis:
         that rank is returned. """
 
         self._rankings_computed = False
+        self._best_strategies_is_oos_qualities = None  # type: Optional[QFDataFrame]
+        self._best_strategies_returns = None  # type: Optional[List[float]]
 
     def calculate_overfitting_probability(self):
         """ Returns the probability of backtest overfitting. """
@@ -95,12 +97,15 @@ class OverfittingAnalysis:
             in sample (quality of the best strategy) nad out of sample (quality of the strategy that was in this
             combination set, the best one in the in-sample period).
         """
-        self.create_is_oos_rankings()
-        oos_qualities = [oos_ranking["quality"].loc[best_is_strategy] for oos_ranking, best_is_strategy
-                         in zip(self.oos_ranking, self.best_is_strategies_names)]
-        is_qualities = [is_ranking["quality"].loc[best_is_strategy] for is_ranking, best_is_strategy
-                        in zip(self.is_ranking, self.best_is_strategies_names)]
-        return QFDataFrame(data={"OOS": oos_qualities, "IS": is_qualities})
+        if self._best_strategies_is_oos_qualities is None:
+            self.create_is_oos_rankings()
+            oos_qualities = [oos_ranking["quality"].loc[best_is_strategy] for oos_ranking, best_is_strategy
+                             in zip(self.oos_ranking, self.best_is_strategies_names)]
+            is_qualities = [is_ranking["quality"].loc[best_is_strategy] for is_ranking, best_is_strategy
+                            in zip(self.is_ranking, self.best_is_strategies_names)]
+            self._best_strategies_is_oos_qualities = QFDataFrame(data={"OOS": oos_qualities, "IS": is_qualities})
+
+        return self._best_strategies_is_oos_qualities
 
     def calculate_relative_rank_logits(self, strategies_names: List):
         """
@@ -124,6 +129,16 @@ class OverfittingAnalysis:
             self.best_is_strategies_names = [is_element["rank"].idxmax() for is_element in self.is_ranking]
             self._rankings_computed = True
 
+    def drop_is_oos_sets(self):
+        """
+        Computes the rankings and the annual returns of the best IS strategies and afterwards drops the IS / OOS sets,
+        which are not needed anymore, in order to free the memory (e.g. before the analysis is sent between processes).
+        """
+        self.create_is_oos_rankings()
+        self._get_best_strategies_returns()
+        self._is_set = None
+        self._oos_set = None
+
     def form_different_is_and_oos_sets(self, multiple_returns_timeseries: QFDataFrame) -> Tuple:
         """
         Splits slices into two groups of equal sizes for all possible combinations.
@@ -185,12 +200,15 @@ class OverfittingAnalysis:
 
     def _get_best_strategies_returns(self) -> List[float]:
         """ Returns the annual returns of the best IS strategies """
-        annual_returns = []
-        for oos_set, best_strategy_name in zip(self._oos_set, self.best_is_strategies_names):
-            best_strategy_tms = oos_set.loc[:, best_strategy_name]
-            annual_simple_return = cagr(best_strategy_tms, Frequency.DAILY)
-            annual_returns.append(annual_simple_return)
-        return annual_returns
+        if self._best_strategies_returns is None:
+            annual_returns = []
+            for oos_set, best_strategy_name in zip(self._oos_set, self.best_is_strategies_names):
+                best_strategy_tms = oos_set.loc[:, best_strategy_name]
+                annual_simple_return = cagr(best_strategy_tms, Frequency.DAILY)
+                annual_returns.append(annual_simple_return)
+            self._best_strategies_returns = annual_returns
+
+        return self._best_strategies_returns
 
     def _calculate_distribution(self, qf_series: QFSeries):
         """
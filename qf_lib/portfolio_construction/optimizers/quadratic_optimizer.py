@@ -16,7 +16,7 @@ from typing import Union, Sequence
 
 import numpy as np
 try:
-    from cvxopt import matrix
+    from cvxopt import matrix, spmatrix, spdiag, sparse
     from cvxopt import solvers
 except ImportError:
     warnings.warn(
@@ -44,7 +44,7 @@ class QuadraticOptimizer:
 
     @classmethod
     def get_optimal_weights(cls, P: np.ndarray = None, q: np.ndarray = None,
-                            upper_constraints: Union[Sequence, float] = None) -> np.ndarray:
+                            upper_constraints: Union[Sequence, float] = None, p_scale: float = 1.0) -> np.ndarray:
         """
         Solves the problem defined by matrix h, vector f and constraints.
 
@@ -57,6 +57,10 @@ class QuadraticOptimizer:
         upper_constraints
             vector of upper limits of weights (if it's a single value, the constraint will be the same for each weight).
             Example: 0.5 means that max allocation of some asset can be 50%.
+        p_scale
+            scalar by which the matrix P is multiplied, so that the caller does not need to materialize the scaled
+            matrix. The problem min (1/2)x'(sP)x + q'x has the same solution as min (1/2)x'Px + (q/s)'x for s > 0,
+            so the scale is applied to the vector q instead.
 
         Returns
         -------
@@ -65,12 +69,12 @@ class QuadraticOptimizer:
         """
         assets_number = P.shape[0]
         if P is not None:
-            P = matrix(P)
+            P = matrix(P) if p_scale > 0 else matrix(p_scale * P)
         else:
             P = matrix(0.0, (assets_number, assets_number))
 
         if q is not None:
-            q = matrix(q)
+            q = matrix(q / p_scale) if p_scale > 0 else matrix(q)
         else:
             q = matrix(0.0, (assets_number, 1))
 
@@ -87,3 +91,56 @@ class QuadraticOptimizer:
         # subject to Gx <= h; Ax = b
         result = solvers.qp(P, q, G, h, A, b, initvals=initial_weights, options=cls.options)
         return np.array(result['x']).squeeze()
+
+    @classmethod
+    def get_optimal_weights_factor(cls, factor_loadings: np.ndarray, specific_var: np.ndarray, q: np.ndarray = None,
+                                   upper_constraints: Union[Sequence, float] = None) -> np.ndarray:
+        """
+        Solves the same problem as get_optimal_weights, for the matrix P given by the factor model: P = F*F' + D,
+        where F is an (n x k) matrix of factor loadings and D is a diagonal matrix of specific variances. P is never
+        materialized. Instead, the problem is solved for the variables (x, y), where y = F'x:
+
+        minimize (1/2)(x'Dx + y'y) + q'x
+        subject to F'x - y = 0 and the constraints on x.
+
+        Parameters
+        ----------
+        factor_loadings
+            (n x k) matrix of factor loadings (F)
+        specific_var
+            vector of n specific variances (diagonal of D)
+        q
+            a vector (can be empty) from the quadratic formula
+        upper_constraints
+            vector of upper limits of weights (if it's a single value, the constraint will be the same for each weight).
+            Example: 0.5 means that max allocation of some asset can be 50%.
+
+        Returns
+        -------
+        weights
+            best weights for the given problem. Sum of all weights is equal 1.
+        """
+        assets_number, factors_number = factor_loadings.shape
+
+        P = spdiag(matrix(np.concatenate([specific_var, np.ones(factors_number)])))
+        q = np.zeros(assets_number) if q is None else q
+        q = matrix(np.concatenate([q, np.zeros(factors_number)]))
+
+        # sum of weights equal 1 and F'x - y = 0
+        A_x, b = constr.sum_weights_equal_1_constraint(assets_number)
+        minus_identity = spmatrix(-1.0, range(factors_number), range(factors_number))
+        A = sparse([[A_x, matrix(factor_loadings.T)], [spmatrix([], [], [], (1, factors_number)), minus_identity]])
+        b = matrix([b, matrix(0.0, (factors_number, 1))])
+
+        G, h = constr.each_weight_greater_than_0_constraint(assets_number)
+        if upper_constraints is not None:
+            G_2, h_2 = constr.upper_bound_constraint(assets_number, upper_constraints)
+            G, h = constr.merge_constraints(G, h, G_2, h_2)
+        # the constraints do not apply to the factor exposures y
+        G = sparse([[G], [spmatrix([], [], [], (G.size[0], factors_number))]])
+
+        initial_weights = np.full(assets_number, 1.0 / assets_number)
+        initial_values = matrix(np.concatenate([initial_weights, factor_loadings.T @ initial_weights]))
+
+        result = solvers.qp(P, q, G, h, A, b, initvals=initial_values, options=cls.options)
+        return np.array(result['x'][:assets_number]).squeeze()
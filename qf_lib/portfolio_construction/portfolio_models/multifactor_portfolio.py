@@ -12,7 +12,8 @@
 #     See the License for the specific language governing permissions and
 #     limitations under the License.
 
-from typing import Union, Sequence
+from functools import lru_cache
+from typing import Union, Sequence, Optional
 
 import numpy as np
 
@@ -22,6 +23,31 @@ from qf_lib.portfolio_construction.optimizers.quadratic_optimizer import Quadrat
 from qf_lib.portfolio_construction.portfolio_models.portfolio import Portfolio
 
 
+_CACHE_SIZE = 128
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def _normalized_factors(factors_bytes: bytes, num_of_assets: int) -> np.ndarray:
+    """
+    Min-max normalizes the factors stored in a (num_of_assets, 4) float64 array, passed as bytes so that the results
+    can be cached. The returned array is shared between the calls and is therefore read-only.
+    """
+    factors = np.frombuffer(factors_bytes, dtype=np.float64).reshape(num_of_assets, -1)
+    min_values = np.nanmin(factors, axis=0)
+    max_values = np.nanmax(factors, axis=0)
+
+    # the subtraction allocates the (writable) result, the remaining steps are done in place
+    factors = factors - min_values
+    factors /= max_values - min_values
+
+    # apply sqrt transform to some of the factors to make their distribution closer to normal
+    np.sqrt(factors[:, 1], out=factors[:, 1])  # max drawdown
+    np.sqrt(factors[:, 3], out=factors[:, 3])  # upside volatility
+
+    factors.flags.writeable = False
+    return factors
+
+
 class PortfolioParameters:
     def __init__(self, min_port_vol_weight, max_mean_ret_weight, min_max_dd_weight, max_skewness_weight,
                  max_up_vol_weight):
@@ -39,12 +65,28 @@ class MultiFactorPortfolio(Portfolio):
     - variance of a portfolio(minimizing),
     - mean return of portfolio's assets (maximizing),
     - max drawdown of the portfolio (minimizing).
+
+    Instead of the covariance matrix, its factor model decomposition F*F' + D can be provided (factor_loadings F and
+    specific_var, i.e. the diagonal of D). The optimisation problem is then solved without materializing the
+    covariance matrix. Only one of the two representations can be passed.
+
+    The normalized factors are cached by their values, so rebuilding the portfolio on each rebalance with unchanged
+    factors reuses them.
     """
 
-    def __init__(self, covariance_matrix: QFDataFrame, mean_return: QFSeries, max_dd: QFSeries,
+    def __init__(self, covariance_matrix: Optional[QFDataFrame], mean_return: QFSeries, max_dd: QFSeries,
                  skewness: QFSeries, up_vol: QFSeries,
-                 parameters: PortfolioParameters, upper_constraint: Union[float, Sequence[float]] = None):
+                 parameters: PortfolioParameters, upper_constraint: Union[float, Sequence[float]] = None,
+                 factor_loadings: Optional[QFDataFrame] = None,
+                 specific_var: Optional[QFSeries] = None):
+        assert (factor_loadings is None) == (specific_var is None), \
+            "Both factor_loadings and specific_var need to be provided to use the factor model"
+        assert (covariance_matrix is None) != (factor_loadings is None), \
+            "Either the covariance matrix or its factor model (but not both) needs to be provided"
+
         self.covariance_matrix = covariance_matrix
+        self.factor_loadings = factor_loadings
+        self.specific_var = specific_var
         self.mean_return = mean_return
         self.max_dd = max_dd
         self.skewness = skewness
@@ -53,48 +95,81 @@ class MultiFactorPortfolio(Portfolio):
         self.parameters = parameters
         self.upper_constraint = upper_constraint
 
+        # names of the assets, to which all the vectors are aligned once, so that later on only raw arrays are used
+        self._assets = covariance_matrix.columns if covariance_matrix is not None else factor_loadings.index
+        self._covariance_values = None if covariance_matrix is None else covariance_matrix.values
+        self._factor_loadings_values = None if factor_loadings is None else factor_loadings.reindex(self._assets).values
+        self._specific_var_values = None if specific_var is None else specific_var.reindex(self._assets).values
         self._normalize_vectors()
 
     def _normalize_vectors(self):
-        # apply sqrt transform to some of the factors to make their distribution closer to normal
-        self.mean_return = self.mean_return.min_max_normalized()
-        self.max_dd = np.sqrt(self.max_dd.min_max_normalized())  # sqrt
-        self.skewness = self.skewness.min_max_normalized()
-        self.upside_vol = np.sqrt(self.upside_vol.min_max_normalized())  # sqrt
+        # min-max normalize all the factors at once, one factor per column
+        factors = np.stack([factor.reindex(self._assets).values for factor in
+                            (self.mean_return, self.max_dd, self.skewness, self.upside_vol)], axis=1)
+        # the cached array is shared between the calls, each portfolio gets its own writable copy of it
+        self._factors = _normalized_factors(factors.astype(np.float64, copy=False).tobytes(), factors.shape[0]).copy()
 
-    def get_weights(self) -> QFSeries:
-        x = self._get_equal_weights()
+        self.mean_return = QFSeries(data=self._factors[:, 0], index=self._assets)
+        self.max_dd = QFSeries(data=self._factors[:, 1], index=self._assets)
+        self.skewness = QFSeries(data=self._factors[:, 2], index=self._assets)
+        self.upside_vol = QFSeries(data=self._factors[:, 3], index=self._assets)
 
-        covariance_value = x.transpose() @ self.covariance_matrix @ x
+    def get_weights(self) -> QFSeries:
+        covariance_value = self._get_equal_weights_covariance_value()
         covariance_impact = 0.5 * covariance_value  # 0.5 stands for 1/2 in minimize (1/2)*x'*P*x + q'*x
 
-        mean_ret_value = x @ self.mean_return
-        max_dd_value = x @ self.max_dd
-        skewness_value = x @ self.skewness
-        upside_vol_value = x @ self.upside_vol
+        # values of all the factors (mean return, max drawdown, skewness, upside volatility) for the equal weights
+        # x = 1/n, which are equal to the means of the factors
+        factors_values = self._factors.mean(axis=0)
 
         # calculate normalising weights, weights that will make all factors of equal importance for the optimizer
-        mean_ret_norm_wt = covariance_impact / mean_ret_value
-        max_dd_norm_wt = covariance_impact / max_dd_value
-        skewness_norm_wt = covariance_impact / skewness_value
-        up_vol_norm_wt = covariance_impact / upside_vol_value
-
-        mean_ret_part = mean_ret_norm_wt * self.parameters.max_mean_ret_weight * self.mean_return * (-1)
-        min_max_dd_part = max_dd_norm_wt * self.parameters.min_max_dd_weight * self.max_dd
-        skewness_part = skewness_norm_wt * self.parameters.max_skewness_weight * self.skewness * (-1)
-        up_vol_part = up_vol_norm_wt * self.parameters.max_up_vol_weight * self.upside_vol * (-1)
+        norm_weights = covariance_impact / factors_values
 
-        # combine all factors together
-        q = mean_ret_part + min_max_dd_part + skewness_part + up_vol_part
-        P = self.parameters.min_port_vol_weight * self.covariance_matrix
+        # combine all factors together, the ones which are maximized enter q with the negative sign
+        parameters_weights = np.array([
+            -self.parameters.max_mean_ret_weight, self.parameters.min_max_dd_weight,
+            -self.parameters.max_skewness_weight, -self.parameters.max_up_vol_weight
+        ])
+        q = self._factors @ (norm_weights * parameters_weights)
 
         # run optimisation
-        weights = QuadraticOptimizer.get_optimal_weights(P.values, q.values, upper_constraints=self.upper_constraint)
-        stocks_weights = QFSeries(data=weights, index=P.columns)
+        if self.factor_loadings is None:
+            # P = min_port_vol_weight * covariance_matrix, the scale is applied by the optimizer
+            covariance_values = self._ensure_positive_definite(self._covariance_values)
+            weights = QuadraticOptimizer.get_optimal_weights(
+                covariance_values, q, upper_constraints=self.upper_constraint,
+                p_scale=self.parameters.min_port_vol_weight)
+        else:
+            # P = min_port_vol_weight * (F*F' + D)
+            scale = self.parameters.min_port_vol_weight
+            weights = QuadraticOptimizer.get_optimal_weights_factor(
+                self._factor_loadings_values * np.sqrt(scale), self._specific_var_values * scale, q,
+                upper_constraints=self.upper_constraint)
+
+        stocks_weights = QFSeries(data=weights, index=self._assets)
         return stocks_weights
 
-    def _get_equal_weights(self):
-        n = self.mean_return.size
-        x = self.mean_return.copy()
-        x[:] = 1/n
-        return x
+    def _get_equal_weights_covariance_value(self) -> float:
+        if self.factor_loadings is None:
+            # for the equal weights x = 1/n, the quadratic form x'Px equals the mean of all elements of P
+            return float(self._covariance_values.mean())
+
+        # for P = F*F' + D the quadratic form equals |F'x|^2 + x'Dx, where F'x contains the column means of F
+        num_of_assets = self._specific_var_values.size
+        return float(np.sum(self._factor_loadings_values.mean(axis=0) ** 2)
+                     + self._specific_var_values.sum() / num_of_assets ** 2)
+
+    def _ensure_positive_definite(self, P: np.ndarray) -> np.ndarray:
+        """
+        Checks if P is positive definite by attempting its Cholesky decomposition. If it is not (e.g. the covariance
+        matrix is singular, because there are more assets than observations), a small jitter proportional to the
+        mean variance is added to its diagonal, so that the optimizer is not given a rank deficient problem.
+        """
+        try:
+            np.linalg.cholesky(P)
+            return P
+        except np.linalg.LinAlgError:
+            jitter = 1e-8 * np.diag(P).mean()
+            self.logger().warning("The covariance matrix is not positive definite. Adding {:e} to its diagonal."
+                                  .format(jitter))
+            return P + jitter * np.eye(P.shape[0])
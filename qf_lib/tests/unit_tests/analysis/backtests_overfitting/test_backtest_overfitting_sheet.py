@@ -0,0 +1,53 @@
+#     Copyright 2016-present CERN – European Organization for Nuclear Research
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+
+import unittest
+from unittest import TestCase
+
+import numpy as np
+
+from qf_lib.analysis.backtests_overfitting.backtest_overfitting_sheet import _linear_fit, _empirical_cdf
+
+
+class TestBacktestOverfittingSheet(TestCase):
+    def test_linear_fit(self):
+        x = np.array([0.3, -1.2, 2.5, 0.8, 1.1, -0.4])
+        y = np.array([1.0, -0.5, 2.1, 0.2, 1.7, 0.4])
+
+        slope, intercept = _linear_fit(x, y)
+
+        expected_slope, expected_intercept = np.polyfit(x, y, deg=1)
+        self.assertAlmostEqual(expected_slope, slope)
+        self.assertAlmostEqual(expected_intercept, intercept)
+
+    def test_linear_fit_of_exact_line(self):
+        x = np.arange(10, dtype=float)
+        slope, intercept = _linear_fit(x, -2.0 * x + 3.0)
+
+        self.assertAlmostEqual(-2.0, slope)
+        self.assertAlmostEqual(3.0, intercept)
+
+    def test_empirical_cdf_with_ties(self):
+        values = np.array([0.5, -1.0, 0.5, 2.0, 0.5, -1.0])
+
+        x_values, probabilities = _empirical_cdf(values)
+
+        # tied values are collapsed, so that there is one probability per unique value
+        self.assertEqual(x_values.shape, probabilities.shape)
+        self.assertTrue(np.array_equal(np.array([-1.0, 0.5, 2.0]), x_values))
+        self.assertTrue(np.allclose(np.array([2 / 6, 5 / 6, 1.0]), probabilities))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+#     Copyright 2016-present CERN – European Organization for Nuclear Research
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+from qf_lib.analysis.backtests_overfitting.overfitting_analysis import OverfittingAnalysis
+from qf_lib.containers.dataframe.simple_returns_dataframe import SimpleReturnsDataFrame
+
+
+class TestOverfittingAnalysis(TestCase):
+    def setUp(self):
+        np.random.seed(5)
+        index = pd.bdate_range(start="2020-01-01", periods=120)
+        returns = SimpleReturnsDataFrame(data=np.random.normal(0.0005, 0.01, (120, 5)), index=index,
+                                         columns=["s{}".format(i) for i in range(5)])
+        self.overfitting_analysis = OverfittingAnalysis(returns, ranking_function=lambda series: series.mean(),
+                                                        num_of_slices=4)
+
+    def test_get_best_strategies_is_oos_qualities(self):
+        qualities = self.overfitting_analysis.get_best_strategies_is_oos_qualities()
+
+        oa = self.overfitting_analysis
+        expected_is = [is_ranking["quality"].max() for is_ranking in oa.is_ranking]
+        expected_oos = [oos_ranking["quality"].loc[name]
+                        for oos_ranking, name in zip(oa.oos_ranking, oa.best_is_strategies_names)]
+        self.assertTrue(np.allclose(expected_is, qualities["IS"].values))
+        self.assertTrue(np.allclose(expected_oos, qualities["OOS"].values))
+
+    def test_get_best_strategies_is_oos_qualities_is_cached(self):
+        qualities = self.overfitting_analysis.get_best_strategies_is_oos_qualities()
+
+        with patch.object(self.overfitting_analysis, "create_is_oos_rankings") as create_is_oos_rankings:
+            cached_qualities = self.overfitting_analysis.get_best_strategies_is_oos_qualities()
+
+        self.assertIs(qualities, cached_qualities)
+        create_is_oos_rankings.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
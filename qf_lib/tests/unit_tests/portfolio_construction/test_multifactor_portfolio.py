@@ -0,0 +1,175 @@
+#     Copyright 2016-present CERN – European Organization for Nuclear Research
+#
+#     Licensed under the Apache License, Version 2.0 (the "License");
+#     you may not use this file except in compliance with the License.
+#     You may obtain a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS,
+#     WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#     See the License for the specific language governing permissions and
+#     limitations under the License.
+
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+
+from qf_lib.common.utils.returns.max_drawdown import max_drawdown
+from qf_lib.containers.dataframe.qf_dataframe import QFDataFrame
+from qf_lib.containers.series.qf_series import QFSeries
+from qf_lib.portfolio_construction.optimizers.quadratic_optimizer import QuadraticOptimizer
+from qf_lib.portfolio_construction.portfolio_models.multifactor_portfolio import MultiFactorPortfolio, \
+    PortfolioParameters
+from qf_lib.tests.unit_tests.portfolio_construction.utils import assets_df
+
+
+class TestMultiFactorPortfolio(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.assets_df = assets_df
+        cls.parameters = PortfolioParameters(min_port_vol_weight=1.0, max_mean_ret_weight=1.0, min_max_dd_weight=1.0,
+                                             max_skewness_weight=1.0, max_up_vol_weight=1.0)
+
+    def _get_portfolio(self, **kwargs):
+        return MultiFactorPortfolio(self.assets_df.cov(), self.assets_df.mean(), self.assets_df.apply(max_drawdown),
+                                    self.assets_df.skew(), self.assets_df.std(), self.parameters, **kwargs)
+
+    def test_get_weights(self):
+        actual_weights = self._get_portfolio().get_weights()
+
+        expected_weights_vals = np.zeros(20)
+        expected_weights_vals[5] = 0.004
+        expected_weights_vals[6] = 0.0662
+        expected_weights_vals[10] = 0.133
+        expected_weights_vals[17] = 0.0855
+        expected_weights_vals[18] = 0.5615
+        expected_weights_vals[19] = 0.1497
+
+        self.assertTrue(np.allclose(expected_weights_vals, actual_weights.values, rtol=0, atol=1e-03))
+        self.assertListEqual(list(self.assets_df.columns), list(actual_weights.index))
+
+    def test_get_weights_with_upper_limits(self):
+        actual_weights = self._get_portfolio(upper_constraint=0.1).get_weights()
+
+        expected_weights_vals = np.zeros(20)
+        expected_weights_vals[2] = 0.0673
+        expected_weights_vals[4] = 0.1
+        expected_weights_vals[5] = 0.0607
+        expected_weights_vals[6] = 0.1
+        expected_weights_vals[7] = 0.1
+        expected_weights_vals[10] = 0.1
+        expected_weights_vals[11] = 0.0767
+        expected_weights_vals[13] = 0.0479
+        expected_weights_vals[16] = 0.0474
+        expected_weights_vals[17] = 0.1
+        expected_weights_vals[18] = 0.1
+        expected_weights_vals[19] = 0.1
+
+        self.assertTrue(np.allclose(expected_weights_vals, actual_weights.values, rtol=0, atol=1e-03))
+
+    def test_get_weights_for_cached_factors(self):
+        expected_weights = self._get_portfolio().get_weights()
+
+        # the normalized factors are cached, but each portfolio gets its own copy of them
+        portfolio = self._get_portfolio()
+        portfolio.mean_return[:] = 0.0
+        actual_weights = self._get_portfolio().get_weights()
+
+        self.assertTrue(np.allclose(expected_weights.values, actual_weights.values, rtol=0, atol=1e-06))
+
+    def test_get_weights_with_factor_model(self):
+        # decompose the covariance matrix into 3 principal components and the diagonal of specific variances
+        covariance_matrix = self.assets_df.cov()
+        eigenvalues, eigenvectors = np.linalg.eigh(covariance_matrix.values)
+        factor_loadings = eigenvectors[:, -3:] * np.sqrt(eigenvalues[-3:])
+        specific_var = np.diag(covariance_matrix.values - factor_loadings @ factor_loadings.T)
+
+        factor_loadings = QFDataFrame(data=factor_loadings, index=covariance_matrix.index)
+        specific_var = QFSeries(data=specific_var, index=covariance_matrix.index)
+        factor_model_covariance = QFDataFrame(data=factor_loadings.values @ factor_loadings.values.T
+                                              + np.diag(specific_var.values),
+                                              index=covariance_matrix.index, columns=covariance_matrix.columns)
+
+        for upper_constraint in (None, 0.1):
+            expected_weights = MultiFactorPortfolio(
+                factor_model_covariance, self.assets_df.mean(), self.assets_df.apply(max_drawdown),
+                self.assets_df.skew(), self.assets_df.std(), self.parameters, upper_constraint).get_weights()
+            actual_weights = MultiFactorPortfolio(
+                None, self.assets_df.mean(), self.assets_df.apply(max_drawdown), self.assets_df.skew(),
+                self.assets_df.std(), self.parameters, upper_constraint, factor_loadings=factor_loadings,
+                specific_var=specific_var).get_weights()
+
+            self.assertTrue(np.allclose(expected_weights.values, actual_weights.values, rtol=0, atol=1e-04))
+            self.assertListEqual(list(self.assets_df.columns), list(actual_weights.index))
+
+        # the rows of the factor loadings are aligned to the assets of the factors
+        shuffled_factor_loadings = factor_loadings.iloc[::-1]
+        actual_weights = MultiFactorPortfolio(
+            None, self.assets_df.mean(), self.assets_df.apply(max_drawdown), self.assets_df.skew(),
+            self.assets_df.std(), self.parameters, factor_loadings=shuffled_factor_loadings,
+            specific_var=specific_var).get_weights()
+        expected_weights = MultiFactorPortfolio(
+            None, self.assets_df.mean(), self.assets_df.apply(max_drawdown), self.assets_df.skew(),
+            self.assets_df.std(), self.parameters, factor_loadings=factor_loadings,
+            specific_var=specific_var).get_weights()
+        self.assertTrue(np.allclose(expected_weights.loc[actual_weights.index].values, actual_weights.values,
+                                    rtol=0, atol=1e-06))
+
+        with self.assertRaises(AssertionError):
+            MultiFactorPortfolio(covariance_matrix, self.assets_df.mean(), self.assets_df.apply(max_drawdown),
+                                 self.assets_df.skew(), self.assets_df.std(), self.parameters,
+                                 factor_loadings=factor_loadings, specific_var=specific_var)
+
+    def test_get_weights_with_singular_covariance_matrix(self):
+        # with fewer observations than assets the covariance matrix is singular
+        assets_df = self.assets_df.iloc[:15]
+        self.assertLess(np.linalg.matrix_rank(assets_df.cov().values), assets_df.num_of_columns)
+
+        portfolio = MultiFactorPortfolio(assets_df.cov(), assets_df.mean(), assets_df.apply(max_drawdown),
+                                         assets_df.skew(), assets_df.std(), self.parameters)
+        with self.assertLogs("qf.MultiFactorPortfolio", level="WARNING") as logs:
+            actual_weights = portfolio.get_weights()
+
+        self.assertEqual(1, len(logs.output))
+        self.assertIn("not positive definite", logs.output[0])
+        self.assertTrue(np.isfinite(actual_weights.values).all())
+        self.assertTrue((actual_weights.values > -1e-6).all())
+        self.assertAlmostEqual(actual_weights.sum(), 1.0, places=6)
+
+        # the jitter is added to the diagonal of the matrix, which is given to the optimizer
+        with patch.object(QuadraticOptimizer, "get_optimal_weights", return_value=np.full(20, 0.05)) as optimizer:
+            portfolio.get_weights()
+        P = optimizer.call_args[0][0]
+        covariance_values = assets_df.cov().values
+        jitter = np.diag(P - covariance_values)
+        self.assertTrue((jitter > 0).all())
+        self.assertTrue(np.allclose(jitter, jitter[0]))
+        off_diagonal = ~np.eye(20, dtype=bool)
+        self.assertTrue(np.array_equal(covariance_values[off_diagonal], P[off_diagonal]))
+        np.linalg.cholesky(P)
+
+    def test_positive_definite_covariance_matrix_is_not_changed(self):
+        covariance_values = self.assets_df.cov().values
+
+        with patch.object(QuadraticOptimizer, "get_optimal_weights", return_value=np.full(20, 0.05)) as optimizer:
+            self._get_portfolio().get_weights()
+
+        self.assertTrue(np.array_equal(covariance_values, optimizer.call_args[0][0]))
+
+    def test_normalized_factors(self):
+        portfolio = self._get_portfolio()
+
+        for factor in (portfolio.mean_return, portfolio.max_dd, portfolio.skewness, portfolio.upside_vol):
+            self.assertAlmostEqual(factor.min(), 0.0)
+            self.assertAlmostEqual(factor.max(), 1.0)
+
+        expected_max_dd = np.sqrt(self.assets_df.apply(max_drawdown).min_max_normalized())
+        self.assertTrue(np.allclose(expected_max_dd.values, portfolio.max_dd.values))
+
+
+if __name__ == '__main__':
+    unittest.main()
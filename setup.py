@@ -59,7 +59,7 @@ setup(
         "quandl": ["quandl>=3.6.1,<=3.7.0"],
         "yfinance": ["yfinance>=0.2.55"],
         "detailed_analysis": ["statsmodels>=0.13.0,<0.14.0", "scipy>=1.6.3 ,<1.12.0", "cvxopt>=1.2.7,<=1.3.2",
-                              "arch>=5.4,<=7.0"],
+                              "arch>=5.4,<=7.0", "python-calamine>=0.1.7"],
         "alpaca": ["alpaca-py>=0.37.0"]
     },
     keywords='quantitative finance backtester',